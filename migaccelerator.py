@@ -1,193 +1,428 @@
 import os
 import base64
-import requests
-import json
+import asyncio
+import functools
+import hashlib
+import logging
+import httpx
+import orjson
 import re
 import yaml
-from urllib.parse import urlparse
-
-# Headers will be initialized dynamically
-headers = {}
+from typing import NamedTuple
+from diskcache import Cache
+
+# HTTP/2 needs the optional h2 package (httpx[http2]); fall back to HTTP/1.1 without it
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+logger = logging.getLogger('migaccelerator')
+
+# Connection pool size shared by all requests to dev.azure.com
+CONNECTION_POOL_SIZE = 50
+
+# httpx defaults to a 5s timeout; large repository lists, YAML exports and pushes
+# can take much longer, so allow up to 5 minutes to read a response
+REQUEST_TIMEOUT = httpx.Timeout(30.0, read=300.0)
+
+# Cap on pipelines processed concurrently, to stay under Azure DevOps rate limits
+MAX_CONCURRENT_PIPELINES = 10
+
+# Prefer the libyaml-backed C loader/dumper when PyYAML was built with it
+YamlLoader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+YamlDumper = getattr(yaml, 'CSafeDumper', yaml.SafeDumper)
+
+# Matches both classic pipeline URLs (_build?definitionId=<id>) and YAML
+# export URLs (_apis/build/definitions/<id>/yaml)
+_ADO_URL_RE = re.compile(
+    r'https://dev\.azure\.com/(?P<org>[^/]+)/(?P<project>[^/]+)/'
+    r'(?:_build\?definitionId=(?P<bid>\d+)|_apis/build/definitions/(?P<yid>\d+)/yaml)'
+)
+
+# Per-run caches of repository lists and branch heads, keyed by their lookup
+# arguments. They hold tasks so concurrent pipelines share one in-flight request.
+_REPO_CACHE = {}
+_COMMIT_CACHE = {}
+
+# Cross-run on-disk cache, so repeated invocations skip lookups that are still fresh.
+# Branch heads move more often than repository lists, hence the shorter TTL.
+DISK_CACHE_DIR = os.path.expanduser("~/.migaccelerator-cache")
+REPOS_CACHE_TTL = 300
+COMMIT_CACHE_TTL = 60
+
+# Opened by run_pipeline_conversion unless caching is disabled. Keys are scoped
+# by a short hash of the auth header, so data fetched under one PAT isn't served to another.
+_disk_cache = None
+_disk_cache_scope = ''
+
+def _disk_cache_get(key):
+    if _disk_cache is None:
+        return None
+    return _disk_cache.get(f"{_disk_cache_scope}:{key}")
+
+def _disk_cache_set(key, value, ttl):
+    if _disk_cache is not None:
+        _disk_cache.set(f"{_disk_cache_scope}:{key}", value, expire=ttl)
+
+def _check_auth_failure(status):
+    # Entries cached under credentials that are no longer accepted can't be trusted
+    if status in (401, 403) and _disk_cache is not None:
+        logger.warning("⚠️ Authentication failed (%s), clearing on-disk cache.", status)
+        _disk_cache.clear()
+
+# Error bodies are truncated so a failing call never decodes a multi-MB payload
+ERROR_BODY_LIMIT = 1024
+
+def _log_err(response, context):
+    body = response.content[:ERROR_BODY_LIMIT]
+    logger.error("❌ %s: %s %s", context, response.status_code, body.decode('utf-8', 'replace'))
+
+# Azure DevOps throttles with 429 + Retry-After; these and transient 5xx
+# responses are retried with exponential backoff (0.5s, 1s, 2s, ...)
+RETRY_TOTAL = 5
+RETRY_BACKOFF_FACTOR = 0.5
+RETRY_STATUS_FORCELIST = frozenset((429, 500, 502, 503, 504))
+RETRY_MAX_DELAY = 60
+
+# A push that failed after it was sent may still have been applied, and resending
+# it would then fail on the already-updated ref. Non-idempotent requests are only
+# retried when the server rejected them outright or they never left the client.
+IDEMPOTENT_METHODS = frozenset(("GET",))
+UNAPPLIED_STATUS_FORCELIST = frozenset((429, 503))
+UNSENT_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+def _retry_delay(response, attempt):
+    retry_after = response.headers.get('Retry-After') if response is not None else None
+    if retry_after and retry_after.isdigit():
+        return min(int(retry_after), RETRY_MAX_DELAY)
+    return min(RETRY_BACKOFF_FACTOR * (2 ** attempt), RETRY_MAX_DELAY)
+
+async def _request(client, method, url, **kwargs):
+    idempotent = method in IDEMPOTENT_METHODS
+    retry_statuses = RETRY_STATUS_FORCELIST if idempotent else UNAPPLIED_STATUS_FORCELIST
+
+    for attempt in range(RETRY_TOTAL + 1):
+        try:
+            response = await client.request(method, url, **kwargs)
+        except httpx.TransportError as e:
+            if attempt == RETRY_TOTAL or not (idempotent or isinstance(e, UNSENT_ERRORS)):
+                raise
+            response = None
+            reason = e
+        else:
+            if response.status_code not in retry_statuses or attempt == RETRY_TOTAL:
+                return response
+            reason = response.status_code
+
+        delay = _retry_delay(response, attempt)
+        logger.warning("⚠️ %s %s failed (%s), retrying in %ss", method, url, reason, delay)
+        await asyncio.sleep(delay)
+
+def _cached(cache, key, fetch):
+    if key not in cache:
+        cache[key] = asyncio.ensure_future(fetch())
+    return cache[key]
+
+def _clear_caches():
+    _REPO_CACHE.clear()
+    _COMMIT_CACHE.clear()
+
+async def get_repositories(client, org, project):
+    return await _cached(_REPO_CACHE, (org, project),
+                         lambda: _fetch_repositories(client, org, project))
+
+async def _fetch_repositories(client, org, project):
+    cache_key = f"repos:{org}:{project}"
+    repositories = _disk_cache_get(cache_key)
+    if repositories is not None:
+        logger.info("♻️ Using cached repositories for project '%s'", project)
+        return repositories
 
-def get_repositories(org, project):
     url = f"https://dev.azure.com/{org}/{project}/_apis/git/repositories?api-version=6.0"
-    print(f"\n📥 Requesting repositories from: {url}")
-    print(f"🔐 Using headers: {headers}")
+    logger.info("📥 Requesting repositories from: %s", url)
+    logger.debug("🔐 Using headers: %s", client.headers)
 
-    response = requests.get(url, headers=headers)
-    print(f"📡 Status code: {response.status_code}")
-    print(f"📃 Response: {response.text}")
+    response = await _request(client, "GET", url)
+    logger.debug("📡 Status code: %s", response.status_code)
 
     if response.status_code == 200:
-        repos_data = response.json()
+        repos_data = orjson.loads(response.content)
         repositories = {repo['name']: repo['id'] for repo in repos_data['value']}
-        print(f"✅ Found {len(repositories)} repositories in project '{project}'")
+        logger.info("✅ Found %d repositories in project '%s'", len(repositories), project)
+        _disk_cache_set(cache_key, repositories, REPOS_CACHE_TTL)
         return repositories
     else:
-        print(f"❌ Failed to retrieve repositories.")
+        _check_auth_failure(response.status_code)
+        _log_err(response, "Failed to retrieve repositories")
         return {}
 
-def get_converted_yaml_content(yaml_url):
-    print(f"\n📥 Fetching YAML content from: {yaml_url}")
-    response = requests.get(yaml_url, headers=headers)
+async def get_converted_yaml_content(client, yaml_url):
+    logger.info("📥 Fetching YAML content from: %s", yaml_url)
+    response = await _request(client, "GET", yaml_url)
     if response.status_code == 200:
         # Extract the YAML content
-        yaml_content = response.json()["yaml"]
+        yaml_content = orjson.loads(response.content)["yaml"]
 
         # Remove "..." from the YAML content
         yaml_content = yaml_content.replace("...", "")
         return yaml_content
     else:
-        print(f"❌ Failed to retrieve YAML content.")
-        print(f"🔢 Status code: {response.status_code}, 🧾 Error: {response.text}")
+        _check_auth_failure(response.status_code)
+        _log_err(response, "Failed to retrieve YAML content")
         return None
 
-def get_latest_commit(org, project, repo_id, branch_name="master"):
+# Branches a converted pipeline is created from, in order of preference
+DEFAULT_BRANCHES = ("master", "main")
+
+async def get_default_branch_commit(client, org, project, repo_id):
+    return await _cached(_COMMIT_CACHE, (org, project, repo_id),
+                         lambda: _fetch_default_branch_commit(client, org, project, repo_id))
+
+async def _fetch_default_branch_commit(client, org, project, repo_id):
+    cache_key = f"commit:{org}:{project}:{repo_id}"
+    latest_commit = _disk_cache_get(cache_key)
+    if latest_commit is not None:
+        logger.info("♻️ Using cached latest commit for repository '%s': %s", repo_id, latest_commit)
+        return latest_commit
+
+    # One request lists every branch head; master/main are resolved locally
     base_url = f"https://dev.azure.com/{org}/{project}/_apis/git/repositories/{repo_id}"
-    url = f"{base_url}/refs?filter=heads/{branch_name}&api-version=6.0"
-    print(f"\n🔍 Getting latest commit for branch '{branch_name}'")
+    url = f"{base_url}/refs?filter=heads/&api-version=6.0"
+    logger.info("🔍 Getting branch heads for repository '%s'", repo_id)
 
-    response = requests.get(url, headers=headers)
+    response = await _request(client, "GET", url)
     if response.status_code == 200:
-        data = response.json()
-        if data['value']:
-            latest_commit = data['value'][0]['objectId']
-            print(f"✅ Latest commit on '{branch_name}': {latest_commit}")
-            return latest_commit
-        else:
-            print(f"⚠️ No commits found for branch '{branch_name}'")
-            return None
+        data = orjson.loads(response.content)
+        heads = {ref['name']: ref['objectId'] for ref in data['value']}
+        for branch_name in DEFAULT_BRANCHES:
+            latest_commit = heads.get(f"refs/heads/{branch_name}")
+            if latest_commit:
+                logger.info("✅ Latest commit on '%s': %s", branch_name, latest_commit)
+                _disk_cache_set(cache_key, latest_commit, COMMIT_CACHE_TTL)
+                return latest_commit
+        logger.warning("⚠️ No commits found for branches %s", ", ".join(DEFAULT_BRANCHES))
+        return None
     else:
-        print(f"❌ Failed to get latest commit. Status code: {response.status_code}")
+        _check_auth_failure(response.status_code)
+        _log_err(response, "Failed to get latest commit")
         return None
 
-def create_branch_with_yaml(org, project, repo_id, repo_name, yaml_content, definition_id):
+# Serialized body of a push that creates one branch with a single added file.
+# Only the five %b slots change per pipeline; each is filled with an
+# orjson-encoded JSON string, so no per-call dict tree is built.
+_PUSH_TEMPLATE = (
+    b'{"refUpdates":[{"name":%b,"oldObjectId":%b}],'
+    b'"commits":[{"comment":%b,"changes":[{"changeType":"add","item":{"path":%b},'
+    b'"newContent":{"content":%b,"contentType":"rawText"}}]}]}'
+)
+
+def _build_push_payload(ref_name, old_object_id, comment, path, content):
+    return _PUSH_TEMPLATE % tuple(map(orjson.dumps, (ref_name, old_object_id, comment, path, content)))
+
+def _reformat_yaml_content(yaml_content):
+    parsed = yaml.load(yaml_content, Loader=YamlLoader)
+    return yaml.dump(parsed, Dumper=YamlDumper, sort_keys=False, default_flow_style=False)
+
+async def create_branch_with_yaml(client, org, project, repo_id, repo_name, yaml_content, definition_id,
+                                  reformat=False):
+    if reformat:
+        yaml_content = _reformat_yaml_content(yaml_content)
+
     new_branch_name = f"converted-pipeline-{definition_id}"
     base_url = f"https://dev.azure.com/{org}/{project}/_apis/git/repositories/{repo_id}"
 
-    latest_commit = get_latest_commit(org, project, repo_id, "master") or \
-                    get_latest_commit(org, project, repo_id, "main")
+    latest_commit = await get_default_branch_commit(client, org, project, repo_id)
 
     if not latest_commit:
-        print(f"❌ Could not find master or main branch for repository '{repo_name}'")
+        logger.error("❌ Could not find master or main branch for repository '%s'", repo_name)
         return False
 
     url = f"{base_url}/pushes?api-version=6.0"
 
-    data = {
-        "refUpdates": [
-            {
-                "name": f"refs/heads/{new_branch_name}",
-                "oldObjectId": latest_commit
-            }
-        ],
-        "commits": [
-            {
-                "comment": f"Add converted YAML pipeline (definition ID: {definition_id})",
-                "changes": [
-                    {
-                        "changeType": "add",
-                        "item": {
-                            "path": f"/pipelines/converted-pipeline-{definition_id}.yaml"
-                        },
-                        "newContent": {
-                            "content": yaml_content,
-                            "contentType": "rawText"
-                        }
-                    }
-                ]
-            }
-        ]
-    }
-
-    print(f"\n🚀 Creating branch '{new_branch_name}' in repo '{repo_name}'")
-    response = requests.post(url, headers=headers, json=data)
+    data = _build_push_payload(
+        ref_name=f"refs/heads/{new_branch_name}",
+        old_object_id=latest_commit,
+        comment=f"Add converted YAML pipeline (definition ID: {definition_id})",
+        path=f"/pipelines/converted-pipeline-{definition_id}.yaml",
+        content=yaml_content,
+    )
 
-    print(f"📡 Push response: {response.status_code}")
-    print(f"📃 {response.text}")
+    logger.info("🚀 Creating branch '%s' in repo '%s'", new_branch_name, repo_name)
+    response = await _request(client, "POST", url, content=data, headers={'Content-Type': 'application/json'})
+    logger.debug("📡 Push response: %s", response.status_code)
 
     if response.status_code == 201:
-        print(f"✅ Successfully created branch and added pipeline YAML.")
+        logger.info("✅ Successfully created branch and added pipeline YAML.")
         return True
     else:
-        print(f"❌ Failed to create branch or commit YAML.")
+        _check_auth_failure(response.status_code)
+        _log_err(response, "Failed to create branch or commit YAML")
         return False
 
-def read_input_urls(file_path):
+def iter_input_urls(file_path):
+    # Yields URLs as they are read, so dispatch can start before the whole file is loaded
     try:
         with open(file_path, 'r') as file:
-            urls = [line.strip() for line in file if line.strip()]
-            return urls
+            for line in file:
+                url = line.strip()
+                if url:
+                    yield url
     except FileNotFoundError:
-        print(f"❌ Input file '{file_path}' not found.")
-        return []
+        logger.error("❌ Input file '%s' not found.", file_path)
     except Exception as e:
-        print(f"❌ Error reading input file: {e}")
-        return []
+        logger.error("❌ Error reading input file: %s", e)
+
+class PipelineInfo(NamedTuple):
+    organization: str
+    project: str
+    definition_id: str
+    base_url: str
+
+@functools.lru_cache(maxsize=1024)
+def parse_pipeline_url(url):
+    # Returns a PipelineInfo, or None when the URL doesn't match
+    match = _ADO_URL_RE.search(url)
+    if not match:
+        return None
+
+    org, project = match['org'], match['project']
+    return PipelineInfo(org, project, match['bid'] or match['yid'], f"https://dev.azure.com/{org}/{project}")
+
+async def process_pipeline(client, pipeline_info, reformat_yaml=False):
+    project = pipeline_info.project
+    definition_id = pipeline_info.definition_id
 
-def process_pipeline(org, project, definition_id):
-    print(f"\n🔄 Processing pipeline definition ID: {definition_id} from project '{project}'")
+    logger.info("🔄 Processing pipeline definition ID: %s from project '%s'", definition_id, project)
 
-    yaml_url = f"https://dev.azure.com/{org}/{project}/_apis/build/definitions/{definition_id}/yaml"
-    yaml_content = get_converted_yaml_content(yaml_url)
+    yaml_url = f"{pipeline_info.base_url}/_apis/build/definitions/{definition_id}/yaml"
+    yaml_content, repositories = await asyncio.gather(
+        get_converted_yaml_content(client, yaml_url),
+        # Shared per (org, project) through _REPO_CACHE, so each project is fetched once
+        get_repositories(client, pipeline_info.organization, project),
+    )
 
     if not yaml_content:
         return False
 
-    repositories = get_repositories(org, project)
     if not repositories:
         return False
 
-    target_repo = project if project in repositories else list(repositories.keys())[0]
+    target_repo = project if project in repositories else next(iter(repositories))
     target_repo_id = repositories[target_repo]
 
-    print(f"📁 Target repository: {target_repo} (ID: {target_repo_id})")
+    logger.info("📁 Target repository: %s (ID: %s)", target_repo, target_repo_id)
+
+    return await create_branch_with_yaml(client, pipeline_info.organization, project, target_repo_id, target_repo, yaml_content,
+                                         definition_id, reformat=reformat_yaml)
+
+async def _pipeline_worker(client, queue, results, reformat_yaml):
+    while True:
+        pipeline_info = await queue.get()
+        try:
+            results.append(await process_pipeline(client, pipeline_info, reformat_yaml))
+        except Exception as e:
+            results.append(e)
+        finally:
+            queue.task_done()
+
+async def main(client, input_file, reformat_yaml=False):
+    # A fixed pool of workers caps concurrent pipelines; the bounded queue
+    # lets them start on the first URLs while the rest of the file is read
+    queue = asyncio.Queue(maxsize=MAX_CONCURRENT_PIPELINES)
+    results = []
+    workers = [asyncio.create_task(_pipeline_worker(client, queue, results, reformat_yaml))
+               for _ in range(MAX_CONCURRENT_PIPELINES)]
+
+    # Skip duplicate pipelines
+    seen = set()
+    total_count = 0
+
+    for url in iter_input_urls(input_file):
+        # Cheap substring check rejects unrelated lines before the cache lookup and regex
+        pipeline_info = parse_pipeline_url(url) if 'dev.azure.com' in url else None
+        if pipeline_info:
+            if pipeline_info in seen:
+                logger.info("⏭️ Skipping duplicate pipeline URL: %s", url)
+                continue
+            seen.add(pipeline_info)
+            logger.info("📌 Matched: Org='%s', Project='%s', DefinitionID='%s'", pipeline_info.organization,
+                        pipeline_info.project, pipeline_info.definition_id)
+            await queue.put(pipeline_info)
+        else:
+            logger.error("❌ Invalid pipeline URL format: %s", url)
+        total_count += 1
 
-    return create_branch_with_yaml(org, project, target_repo_id, target_repo, yaml_content, definition_id)
+    await queue.join()
+    for worker in workers:
+        worker.cancel()
+    await asyncio.gather(*workers, return_exceptions=True)
 
-def main(input_file):
-    original_urls = read_input_urls(input_file)
-    if not original_urls:
-        print("❌ No URLs found. Exiting.")
+    if not total_count:
+        logger.error("❌ No URLs found. Exiting.")
         return
 
-    print(f"🔗 Found {len(original_urls)} URLs to process.")
-
     successful_count = 0
-
-    for url in original_urls:
-        match = re.search(r'https://dev\.azure\.com/([^/]+)/([^/]+)/_build\?definitionId=(\d+)', url)
-        if match:
-            org, project, def_id = match.groups()
-            print(f"\n📌 Matched: Org='{org}', Project='{project}', DefinitionID='{def_id}'")
-            success = process_pipeline(org, project, def_id)
-            if success:
-                successful_count += 1
-        else:
-            print(f"❌ Invalid pipeline URL format: {url}")
-
-    print(f"\n📊 Summary: {successful_count}/{len(original_urls)} pipelines processed successfully.")
-
-def run_pipeline_conversion(pat_env_var="ADO_PAT", input_file="Intial_URL_to_be_converted.txt"):
-    global headers
+    for result in results:
+        if isinstance(result, Exception):
+            logger.error("❌ Error while processing pipeline: %s", result)
+        elif result:
+            successful_count += 1
+
+    print(f"\n📊 Summary: {successful_count}/{total_count} pipelines processed successfully.")
+
+def _make_auth_header(pat):
+    return 'Basic ' + base64.b64encode(f':{pat}'.encode('ascii')).decode('ascii')
+
+async def _run_with_client(headers, input_file, reformat_yaml):
+    # Keep connections to dev.azure.com alive and reuse them across all endpoints;
+    # over HTTP/2 concurrent requests are multiplexed on a single connection
+    limits = httpx.Limits(max_connections=CONNECTION_POOL_SIZE, max_keepalive_connections=CONNECTION_POOL_SIZE)
+    _clear_caches()
+    async with httpx.AsyncClient(http2=HTTP2_AVAILABLE, headers=headers, limits=limits,
+                                 timeout=REQUEST_TIMEOUT) as client:
+        await main(client, input_file, reformat_yaml)
+
+def run_pipeline_conversion(pat_env_var="ADO_PAT", input_file="Intial_URL_to_be_converted.txt", use_cache=True,
+                            verbose=False, reformat_yaml=False):
+    global _disk_cache, _disk_cache_scope
+
+    # Configure only this module's logger: DEBUG on the root logger would also enable
+    # httpx/httpcore/h2/hpack debug output, which logs the Authorization header
+    if not logger.handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter('%(levelname)s %(message)s'))
+        logger.addHandler(handler)
+    logger.setLevel(logging.DEBUG if verbose else logging.WARNING)
 
     pat = os.environ.get(pat_env_var)
     if not pat:
         raise ValueError(f"{pat_env_var} environment variable not set.")
 
-    authorization = str(base64.b64encode(bytes(':' + pat, 'ascii')), 'ascii')
     headers = {
         'Accept': 'application/json',
-        'Authorization': 'Basic ' + authorization
+        'Authorization': _make_auth_header(pat)
     }
 
-    print("🔐 Azure DevOps PAT initialized.")
+    logger.info("🔐 Azure DevOps PAT initialized.")
+    if use_cache:
+        # The cache is only an optimization; run uncached if it can't be opened
+        try:
+            _disk_cache = Cache(DISK_CACHE_DIR)
+            _disk_cache_scope = hashlib.sha256(headers['Authorization'].encode('ascii')).hexdigest()[:16]
+        except OSError as e:
+            logger.warning("⚠️ Could not open on-disk cache at '%s', continuing without it: %s", DISK_CACHE_DIR, e)
     try:
-        main(input_file)
+        asyncio.run(_run_with_client(headers, input_file, reformat_yaml))
         return {"status": "complete"}
     except Exception as e:
-        print(f"❌ Error during pipeline conversion: {e}")
+        logger.error("❌ Error during pipeline conversion: %s", e)
         return {"status": "error", "message": str(e)}
+    finally:
+        if _disk_cache is not None:
+            _disk_cache.close()
+            _disk_cache = None
        
 if __name__ == "__main__":
     import argparse
@@ -195,7 +430,12 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Run pipeline conversion.")
     parser.add_argument("--pat-env-var", default="ADO_PAT", help="Name of the environment variable containing the Azure DevOps PAT")
     parser.add_argument("--input-file", default="Intial_URL_to_be_converted.txt", help="Input file with pipeline URLs")
+    parser.add_argument("--no-cache", action="store_true", help="Bypass the on-disk cache of repositories and branch heads")
+    parser.add_argument("--verbose", action="store_true", help="Log progress and request details at DEBUG level")
+    parser.add_argument("--reformat-yaml", action="store_true", help="Normalize the converted YAML before committing it")
 
     args = parser.parse_args()
-    result = run_pipeline_conversion(pat_env_var=args.pat_env_var, input_file=args.input_file)
+    result = run_pipeline_conversion(pat_env_var=args.pat_env_var, input_file=args.input_file,
+                                     use_cache=not args.no_cache, verbose=args.verbose,
+                                     reformat_yaml=args.reformat_yaml)
     print(result)